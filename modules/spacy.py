@@ -3,9 +3,26 @@ from spacy.tokens import Token
 import spacy
 import re
 
+PICLINK_RE = re.compile(r"pic.twitter.com\S+")
+HASHTAG_RE = re.compile(r"#\w+")
+
+
+def is_piclink(token):
+    """
+    Getter for the is_piclink token extension. True if the token is a Twitter picture link
+    """
+    return PICLINK_RE.match(token.text) is not None
+
+
+def is_hashtag(token):
+    """
+    Getter for the is_hashtag token extension. True if the token is a hashtag
+    """
+    return HASHTAG_RE.match(token.text) is not None
+
 
 # Idea from https://stackoverflow.com/questions/43388476/how-could-spacy-tokenize-hashtag-as-a-whole
-def spacy_twitter_model(model='en_core_web_sm'):
+def spacy_twitter_model(model='en_core_web_sm', disable=(), exclude=()):
     """
     Load Spacy model, adding capability to detect Twitter picture links and hashtags
     into Spacy's tokenizer
@@ -13,10 +30,14 @@ def spacy_twitter_model(model='en_core_web_sm'):
     Parameters:
         model: string, optional
             Name of Spacy model to load. Defaults to en_core_web_sm
+        disable: list of str, optional
+            Names of pipeline components to disable when loading the model
+        exclude: list of str, optional
+            Names of pipeline components not to load at all
     Returns:
         Spacy model
     """
-    nlp = spacy.load(model)
+    nlp = spacy.load(model, disable=disable, exclude=exclude)
 
     nlp.Defaults.stop_words |= {'yeah', 'yep', 'ah', 'nah', 'lol', 'oh', 'yes', 'ha', 'haha', 'hahaha', 'maybe',
                                 'like', 'cc', 'let', 'thank', 'thanks', 'sorry', 'fwiw', 'wow', 'icymi'}
@@ -27,11 +48,7 @@ def spacy_twitter_model(model='en_core_web_sm'):
     # overwrite token_match function of the tokenizer
     nlp.tokenizer.token_match = re.compile(re_token_match).match
     # set a custom extension to match if token is a piclink and hashtag
-    Token.set_extension('is_piclink',
-                        getter=lambda token: bool(re.match("pic.twitter.com\S+", token.text)),
-                        force=True)
-    Token.set_extension('is_hashtag',
-                        getter=lambda token: bool(re.match("#\w+", token.text)),
-                        force=True)
+    Token.set_extension('is_piclink', getter=is_piclink, force=True)
+    Token.set_extension('is_hashtag', getter=is_hashtag, force=True)
 
     return nlp
@@ -1,39 +1,105 @@
-from.spacy import spacy_twitter_model
+from.spacy import spacy_twitter_model, is_piclink, is_hashtag
 
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from sklearn.decomposition import NMF, LatentDirichletAllocation
-from sklearn.decomposition._nmf import _beta_divergence
+from spacy.attrs import LIKE_URL, IS_STOP, IS_ALPHA
 
-import pickle
-import datetime as dt
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, HashingVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
+from sklearn.decomposition import NMF, LatentDirichletAllocation, non_negative_factorization
 
-from warnings import simplefilter
+from joblib import Parallel, delayed
+from numba import njit
+import numpy as np
+import scipy.sparse as sp
+import joblib
+from collections import Counter
+import copy
+import functools
+import sys
+
+from warnings import catch_warnings, simplefilter
 from sklearn.exceptions import ConvergenceWarning
-simplefilter("ignore", category=ConvergenceWarning)
 
-nlp = spacy_twitter_model()
+# Pipeline components not needed by twitter_tokenizer, which only uses lexical attributes
+EXCLUDE = ["tok2vec", "tagger", "parser", "ner", "lemmatizer", "attribute_ruler"]
+# Batch size for Spacy NLP pipe
+PIPE_BATCH_SIZE = 512
+# Multiplicative updates of W given the previous day's components, to seed a warm-started NMF
+WARM_START_MAX_ITER = 10
+
+
+@functools.lru_cache(maxsize=1)
+def _get_nlp():
+    """
+    Spacy model used for tokenization, loaded on first use and reused afterwards, so importing
+    this module (e.g. in a worker process) doesn't load the model
+    """
+    return spacy_twitter_model(exclude=EXCLUDE)
 
 
 class TopicSeries:
     """
     Class that holds a time series of Topic models
     """
-    def __init__(self, n_components=5, random_state=42):
+    def __init__(self, n_components=5, random_state=42, learning_method='online', batch_size=1024, max_iter=10,
+                 n_jobs=1, use_hashing=False, n_hash_features=2 ** 18, n_process=1,
+                 min_df=2, max_features=10000):
         """
         Parameters:
             n_components: int, optional
                 Number of topics for each topic model
             random_state: int, optional
                 Random seed for NMF and LatentDirichletAllocation
+            learning_method: {'online', 'batch'}, optional
+                Method used to update LatentDirichletAllocation components
+            batch_size: int, optional
+                Number of documents in each LatentDirichletAllocation online update
+            max_iter: int, optional
+                Maximum number of passes over the data for LatentDirichletAllocation
+            n_jobs: int, optional
+                Number of jobs used in the LatentDirichletAllocation E-step. -1 uses all CPU cores. fit() already
+                runs LatentDirichletAllocation in a thread next to NMF, and the E-step mostly holds the GIL, so more
+                jobs dispatch every mini-batch to a nested pool for little gain
+            use_hashing: bool, optional
+                If True, LatentDirichletAllocation is fitted on HashingVectorizer counts instead of
+                CountVectorizer. Faster, but cv_dict has no feature names to display topics
+            n_hash_features: int, optional
+                Number of features of the HashingVectorizer
+            n_process: int, optional
+                Number of processes of the Spacy NLP pipe. The pipeline only has a tokenizer, so more than one
+                process only pays off for large inputs. -1 uses all CPU cores
+            min_df: int, optional
+                Words in fewer tweets than min_df over the whole date range are left out of the shared vocabulary
+            max_features: int, optional
+                Maximum size of the shared vocabulary, keeping the words in the most tweets. If None, no limit.
+                Every date's topic models have one dense column per word of the vocabulary
         """
         self.n_components = n_components
         self.random_state = random_state
+        self.learning_method = learning_method
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.n_jobs = n_jobs
+        self.use_hashing = use_hashing
+        self.n_hash_features = n_hash_features
+        self.n_process = n_process
+        self.min_df = min_df
+        self.max_features = max_features
         self.cv_dict = {}
         self.tfidf_dict = {}
         self.nmf_dict = {}
         self.lda_dict = {}
+        self.counts_dict = {}
+        self.vocabulary_ = None
 
-    def calculate_nmf(self, date, data):
+    def __setstate__(self, state):
+        """
+        Restore a pickled TopicSeries. Objects pickled by older versions lack the attributes added since,
+        which get their __init__ defaults
+        """
+        self.__init__()
+        self.__dict__.update(state)
+
+    def calculate_nmf(self, date, data, init_date=None, counts=None):
         """
         Fit TF-IDF and NMF models from Sklearn
 
@@ -42,32 +108,99 @@ class TopicSeries:
                 Date in 'yyyy-mm-dd' format
             data: Pandas DataFrame
                 Data for a particular date range for the output of read_raw_data() method in modules.tweet_data
+            init_date: string, optional
+                Date in 'yyyy-mm-dd' format of a fitted NMF model used to initialize this one. If None,
+                NMF is initialized with its default method
+            counts: scipy sparse matrix, optional
+                Output of count_matrix() for data. If given, the TF-IDF model is fitted on these counts
+                instead of counting the tokens in data again
         """
         # TF-IDF model, token_pattern is alpha only words + hashtags
-        tfidf = TfidfVectorizer(tokenizer=self.tokenizer, lowercase=False)
-        tfidf_vecs = tfidf.fit_transform(data)
-        # Fit NMF model with n_components topics with TF-IDF input
-        nmf = NMF(n_components=self.n_components, random_state=self.random_state)
-        nmf.fit_transform(tfidf_vecs)
+        # float32 halves the memory traffic of NMF's sparse-dense products, NMF keeps the input dtype
+        tfidf = TfidfVectorizer(tokenizer=self.tokenizer, lowercase=False, vocabulary=self.vocabulary_,
+                                dtype=np.float32)
+        if counts is None:
+            tfidf_vecs = tfidf.fit_transform(data)
+        else:
+            # Same defaults as TfidfVectorizer, only fit the idf weights and set them in the vectorizer
+            tfidf_transformer = TfidfTransformer().fit(counts)
+            tfidf.idf_ = tfidf_transformer.idf_
+            tfidf_vecs = tfidf_transformer.transform(counts)
+        if self.vocabulary_ is not None:
+            # Sklearn stores a copy of the vocabulary in each vectorizer, share the one dict between all dates
+            tfidf.vocabulary_ = self.vocabulary_
+        # Canonical CSR (sorted indices, no duplicates) for faster sparse products in every NMF iteration
+        tfidf_vecs.sum_duplicates()
+        # Fit NMF model with n_components topics with TF-IDF input. Multiplicative update solver with
+        # Frobenius loss, stops early once the relative change in the loss is below tol
+        nmf_params = dict(n_components=self.n_components, solver='mu', beta_loss='frobenius', tol=1e-3,
+                          max_iter=200, random_state=self.random_state)
+        if init_date is None:
+            # NNDSVDa fills the zeros of NNDSVD, which multiplicative updates can't move away from.
+            # It needs n_components <= min(n_samples, n_features), e.g. days with few tweets use random init
+            init = 'nndsvda' if self.n_components <= min(tfidf_vecs.shape) else 'random'
+            nmf = NMF(init=init, **nmf_params)
+            nmf.fit_transform(tfidf_vecs)
+        else:
+            # Warm start from init_date's model, topics change little from one day to the next.
+            # Needs the shared vocabulary so both models have the same features
+            H = self.nmf_dict[init_date].components_.astype(tfidf_vecs.dtype)
+            # Multiplicative updates can't move exact zeros, e.g. words missing from init_date, so fill
+            # them with the mean of the data as NNDSVDa does
+            avg = tfidf_vecs.mean()
+            H[H == 0] = avg
+            # A rough W is enough to start from, fit_transform refines it. Unlike NMF.transform(), it
+            # stops after a few updates from a constant W instead of solving to convergence
+            W, _, _ = non_negative_factorization(tfidf_vecs, H=H, n_components=self.n_components, init='custom',
+                                                 update_H=False, solver='mu', beta_loss='frobenius',
+                                                 max_iter=WARM_START_MAX_ITER)
+            W[W == 0] = avg
+            nmf = NMF(init='custom', **nmf_params)
+            nmf.fit_transform(tfidf_vecs, W=W, H=H)
         # Add TFIDF and NMF models to their respective dictionaries, with date as key
         self.tfidf_dict[date] = tfidf
         self.nmf_dict[date] = nmf
 
-    def calculate_lda(self, date, data):
+    def calculate_lda(self, date, data, counts=None):
         """
-        Fit CountVectorizer and LDA models from Sklearn
+        Fit CountVectorizer (or HashingVectorizer if use_hashing=True) and LDA models from Sklearn
 
         Parameters:
             date: string
                 Date in 'yyyy-mm-dd' format
             data: Pandas DataFrame
                 Data for a particular date range for the output of read_raw_data() method in modules.tweet_data
+            counts: scipy sparse matrix, optional
+                Output of count_matrix() for data. If given and use_hashing=False, LDA is fitted on these
+                counts instead of counting the tokens in data again
         """
-        # TF-IDF model, token_pattern is alpha only words + hashtags
-        cv = CountVectorizer(tokenizer=self.tokenizer, lowercase=False)
-        count_vecs = cv.fit_transform(data)
+        # CountVectorizer model, token_pattern is alpha only words + hashtags
+        if self.use_hashing:
+            # Stateless, token counts without building a vocabulary
+            cv = HashingVectorizer(n_features=self.n_hash_features, alternate_sign=False, norm=None,
+                                   tokenizer=self.tokenizer, lowercase=False, dtype=np.float32)
+        else:
+            cv = CountVectorizer(tokenizer=self.tokenizer, lowercase=False, vocabulary=self.vocabulary_,
+                                 dtype=np.float32)
+        if counts is None or self.use_hashing:
+            count_vecs = cv.fit_transform(data)
+            if self.vocabulary_ is not None and not self.use_hashing:
+                # Share the vocabulary between all dates instead of the copy made by fit_transform
+                cv.vocabulary_ = self.vocabulary_
+        else:
+            # cv has a fixed vocabulary, so it can transform new data without fitting
+            count_vecs = counts
+        # Canonical CSR (sorted indices, no duplicates) for faster sparse products in every LDA iteration
+        count_vecs.sum_duplicates()
         # Fit LDA model with n_components topics with cv input
-        lda = LatentDirichletAllocation(n_components=self.n_components, random_state=self.random_state)
+        lda = LatentDirichletAllocation(n_components=self.n_components,
+                                        learning_method=self.learning_method,
+                                        batch_size=self.batch_size,
+                                        max_iter=self.max_iter,
+                                        evaluate_every=-1,
+                                        mean_change_tol=1e-3,
+                                        n_jobs=self.n_jobs,
+                                        random_state=self.random_state)
         lda.fit_transform(count_vecs)
         # Add CountVectorizer and LDA models to their respective dictionaries, with date as key
         self.cv_dict[date] = cv
@@ -84,21 +217,88 @@ class TopicSeries:
                 DateTimeIndex of dates which will serve as range for fitting the data
         """
 
+        # Positions of the trading day limits in df, which is sorted by timestamp
+        bounds = df.index.searchsorted(date_range)
+        tweets = df.tweet.values
+        # Tokenize all trading days with a single Spacy pipe, then split the tokens at the day limits
+        print("Tokenizing")
+        tokens = self.tokenize(tweets[bounds[0]:bounds[-1]])
+        starts = bounds - bounds[0]
+        tokens_list = [tokens[starts[i]:starts[i + 1]] for i in range(len(date_range) - 1)]
+        del tokens
+
+        # Vocabulary shared by the models of all dates
+        self.vocabulary_ = self._build_global_vocab(tokens_list)
+
+        print()
+        prev_str_date = None
         for i in range(len(date_range) - 1):
-
             str_date = str(date_range[i + 1].date())
             print("Working on : ", str_date, end="\r")
-            # Take portion of df in the range of a trading day
-            sub_df = df[date_range[i]:(date_range[i + 1] - dt.timedelta(seconds=1))].tweet
-            # Tokenize with Spacy NLP pipe. Disable tagger, parser and ner for faster calculation
-            sub_df = [self.twitter_tokenizer(text) for text in nlp.pipe(sub_df, disable=["tagger", "parser", "ner"])]
-            # Calculate NMF model
-            self.calculate_nmf(str_date, sub_df)
-            # Calculate LDA model
-            self.calculate_lda(str_date, sub_df)
+            sub_df = tokens_list[i]
+            # Count tokens once for both models. Keep the counts and not the tokens, so calc_rec_error
+            # doesn't run Spacy again on the same tweets
+            counts = self.count_matrix(sub_df)
+            self.counts_dict[self._data_key(str_date, tweets[bounds[i]:bounds[i + 1]])] = counts
+            # Calculate NMF and LDA models in parallel threads, both are independent of each other.
+            # NMF is initialized from the previous day's model. Days that reach max_iter are expected, the
+            # warning filter is set here and not in the threads because catch_warnings is not thread-safe
+            with catch_warnings():
+                simplefilter("ignore", category=ConvergenceWarning)
+                Parallel(n_jobs=2, prefer="threads")([delayed(self.calculate_nmf)(str_date, sub_df, prev_str_date,
+                                                                                  counts),
+                                                      delayed(self.calculate_lda)(str_date, sub_df, counts)])
+            prev_str_date = str_date
+            # Tokens are not needed once the day's models are fitted
+            tokens_list[i] = None
 
         print("\nFinished")
 
+    def _build_global_vocab(self, tokens_list):
+        """
+        Build a vocabulary from the tokens of all dates, so every date's vectorizers share the same features.
+        Keeps words in at least min_df tweets, at most max_features of them, sorted as in CountVectorizer
+
+        Parameters:
+            tokens_list: list
+                List with the output of tokenize() for each date
+        Returns:
+            dict
+                Mapping of terms to feature indices
+        """
+        # Number of tweets each word appears in
+        doc_freq = Counter(t for sub_df in tokens_list for tokens in sub_df for t in set(tokens))
+        terms = [t for t, n in doc_freq.items() if n >= self.min_df]
+        if self.max_features is not None and len(terms) > self.max_features:
+            terms = sorted(terms, key=lambda t: (-doc_freq[t], t))[:self.max_features]
+        return {t: i for i, t in enumerate(sorted(terms))}
+
+    def count_matrix(self, tokens_list):
+        """
+        Document-term count matrix over the shared vocabulary, built directly from token ids.
+        Tokens not in the vocabulary are dropped, as in CountVectorizer
+
+        Parameters:
+            tokens_list: List[List[str]]
+                Output of tokenize()
+        Returns:
+            scipy sparse matrix
+                CSR matrix of shape (len(tokens_list), len(vocabulary_)) with float32 counts
+        """
+        lengths = [len(tokens) for tokens in tokens_list]
+        # Map every token of every document to its feature index in one pass, -1 if not in the vocabulary
+        ids = np.fromiter((self.vocabulary_.get(t, -1) for tokens in tokens_list for t in tokens),
+                          dtype=np.int32, count=sum(lengths))
+        doc_ids = np.repeat(np.arange(len(tokens_list)), lengths)
+        in_vocab = ids >= 0
+        indices = ids[in_vocab]
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(doc_ids[in_vocab], minlength=len(tokens_list)))))
+        counts = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                               shape=(len(tokens_list), len(self.vocabulary_)))
+        # Add up repeated tokens in a document, also sorts indices
+        counts.sum_duplicates()
+        return counts
+
     def calc_rec_error(self, df, date_range):
         """
         Calculate reconstruction error. For the data of one trading day, take previous day's NMF
@@ -116,6 +316,9 @@ class TopicSeries:
 
         model_err = []
         new_err = []
+        # Positions of the trading day limits in df, which is sorted by timestamp
+        bounds = df.index.searchsorted(date_range)
+        tweets = df.tweet.values
 
         for i in range(len(date_range) - 1):
             str_date = str(date_range[i + 1].date())
@@ -123,18 +326,22 @@ class TopicSeries:
             print("Working on : ", str_date, end="\r")
 
             # Take portion of df in the range of a trading day
-            sub_df = df[date_range[i]:(date_range[i + 1] - dt.timedelta(seconds=1))].tweet
-            # Tokenize with Spacy NLP pipe. Disable tagger, parser and ner for faster calculation
-            sub_df = [self.twitter_tokenizer(text) for text in nlp.pipe(sub_df, disable=["tagger", "parser", "ner"])]
+            sub_df = tweets[bounds[i]:bounds[i + 1]]
+            key = self._data_key(str_date, sub_df)
             # Use previous day's tfidf model to transform data to tfidf format used to fit NMF model
-            tfidf_vecs = self.tfidf_dict[prev_str_date].transform(sub_df)
-            # Calculate reconstruction error using method from
-            # https://github.com/scikit-learn/scikit-learn/blob/master/sklearn/decomposition/_nmf.py
-            new_rec_err = _beta_divergence(tfidf_vecs,
-                                           self.nmf_dict[prev_str_date].transform(tfidf_vecs),
-                                           self.nmf_dict[prev_str_date].components_,
-                                           'frobenius',
-                                           square_root=True)
+            if key in self.counts_dict:
+                # Reuse counts computed in fit() for the same tweets, all dates share their features
+                tfidf_vecs = _apply_idf(self.counts_dict[key], self.tfidf_dict[prev_str_date].idf_)
+            else:
+                # Tokens are only used once here, stream them into the vectorizer
+                tfidf_vecs = self.tfidf_dict[prev_str_date].transform(self.iter_tokens(sub_df))
+            # NMF transform needs the dtype of the model's components, float32 unless the model was fitted
+            # and pickled by an older version
+            tfidf_vecs = tfidf_vecs.astype(self.nmf_dict[prev_str_date].components_.dtype)
+            # Calculate reconstruction error of previous day's NMF model on the data
+            new_rec_err = reconstruction_error(tfidf_vecs,
+                                               self.nmf_dict[prev_str_date].transform(tfidf_vecs),
+                                               self.nmf_dict[prev_str_date].components_)
             # Reconstruction error from original model
             rec_err = self.nmf_dict[str_date].reconstruction_err_
 
@@ -145,9 +352,100 @@ class TopicSeries:
 
         return model_err, new_err
 
+    @staticmethod
+    def _data_key(date, tweets):
+        """
+        Key of the counts_dict cache, so data other than the one passed to fit() is tokenized again
+
+        Parameters:
+            date: string
+                Date in 'yyyy-mm-dd' format
+            tweets: numpy array[str]
+                Tweets of the trading day
+        Returns:
+            tuple
+                Date and hash of the tweets
+        """
+        return date, joblib.hash(tweets)
+
+    def iter_tokens(self, tweets):
+        """
+        Tokenize tweets with Spacy NLP pipe and twitter_tokenizer, one tweet at a time
+
+        Parameters:
+            tweets: iterable of str
+                Tweets to tokenize
+        Yields:
+            List[str]
+                Tokens of each tweet
+        """
+        for doc in _get_nlp().pipe(tweets, batch_size=PIPE_BATCH_SIZE, n_process=self.n_process):
+            yield self.twitter_tokenizer(doc)
+
+    def tokenize(self, tweets):
+        """
+        Tokenize tweets with Spacy NLP pipe and twitter_tokenizer. Tokens are interned, so repeated
+        words in the returned lists share the same string object
+
+        Parameters:
+            tweets: iterable of str
+                Tweets to tokenize
+        Returns:
+            List[List[str]]
+                List of tokens for each tweet
+        """
+        return [[sys.intern(t) for t in tokens] for tokens in self.iter_tokens(tweets)]
+
     def save(self, file_path='data/topics.p'):
+        """
+        Save fitted vectorizers and topic models with joblib. Model components are stored as float32
+        and the counts cached by fit() are not saved. Load with TopicSeries.load()
+
+        Parameters:
+            file_path: string, optional
+                File path where the models will be written to
+        """
+        joblib.dump({'params': {'n_components': self.n_components,
+                                'random_state': self.random_state,
+                                'learning_method': self.learning_method,
+                                'batch_size': self.batch_size,
+                                'max_iter': self.max_iter,
+                                'n_jobs': self.n_jobs,
+                                'use_hashing': self.use_hashing,
+                                'n_hash_features': self.n_hash_features,
+                                'n_process': self.n_process,
+                                'min_df': self.min_df,
+                                'max_features': self.max_features},
+                     'vocabulary_': self.vocabulary_,
+                     'cv_dict': self.cv_dict,
+                     'tfidf_dict': self.tfidf_dict,
+                     'nmf_dict': {date: _float32_components(nmf) for date, nmf in self.nmf_dict.items()},
+                     'lda_dict': {date: _float32_components(lda) for date, lda in self.lda_dict.items()}},
+                    file_path,
+                    compress=3)
+
+    @classmethod
+    def load(cls, file_path='data/topics.p'):
+        """
+        Load models written by save(), or a TopicSeries pickled by older versions
 
-        pickle.dump(self, open(file_path, "wb"))
+        Parameters:
+            file_path: string, optional
+                File path of the saved models
+        Returns:
+            TopicSeries
+        """
+        saved = joblib.load(file_path)
+        if isinstance(saved, cls):
+            # Plain pickle of the whole object written by older versions
+            return saved
+        ts = cls(**saved['params'])
+        ts.vocabulary_ = saved['vocabulary_']
+        ts.cv_dict = saved['cv_dict']
+        ts.tfidf_dict = saved['tfidf_dict']
+        ts.nmf_dict = saved['nmf_dict']
+        ts.lda_dict = saved['lda_dict']
+        return ts
 
     @staticmethod
     def tokenizer(d):
@@ -176,39 +474,122 @@ class TopicSeries:
             hashtags: bool, optional
                 If True, remove hashtags
             lemma: bool, optional
-            If True, lemmatizes words
+                If True, lemmatizes words. Needs a doc from a model with a lemmatizer, which the model
+                used by tokenize() excludes
 
         Returns:
             List[str]
                 List of tokens
         """
-        # token collector
-        tokens = []
-        for t in doc:
-            # remove URLs
-            if t.like_url or t._.is_piclink & urls:
-                continue
-            # only include stop words if stop words==True
-            if t.is_stop & stop_words:
-                continue
-            # if alpha_only=True, only include alpha characters unless they are hashtags
-            if not t.is_alpha & alpha_only:
-                # only include hashtags if hashtags=True
-                if hashtags:
-                    continue
-                else:
-                    if not t._.is_hashtag:
-                        continue
-            if lemma:
-                t = t.lemma_
-            else:
-                t = t.text
-            if lowercase:
-                t = t.lower()
-            tokens.append(t)
+        if lemma and not doc.has_annotation("LEMMA"):
+            raise ValueError("lemma=True needs a Spacy model with a lemmatizer, the doc has no lemmas")
+        # Lexical flags for all tokens in a single call, one row per token
+        flags = doc.to_array([LIKE_URL, IS_STOP, IS_ALPHA]).reshape(-1, 3)
+        # Call the extension getters directly, skipping the lookups through t._
+        piclinks = np.fromiter((is_piclink(t) for t in doc), bool, len(doc))
+        hashtag_tokens = np.fromiter((is_hashtag(t) for t in doc), bool, len(doc))
+        keep = _filter_tokens(flags, piclinks, hashtag_tokens, urls, stop_words, alpha_only, hashtags)
+
+        tokens = [doc[i].lemma_ if lemma else doc[i].text for i in np.flatnonzero(keep)]
+        if lowercase:
+            tokens = [t.lower() for t in tokens]
         return tokens
 
 
+@njit(cache=True)
+def _filter_tokens(flags, piclinks, hashtag_tokens, urls, stop_words, alpha_only, hashtags):
+    """
+    Decide which tokens twitter_tokenizer keeps, compiled with Numba
+
+    Parameters:
+        flags: numpy array
+            Output of Doc.to_array([LIKE_URL, IS_STOP, IS_ALPHA])
+        piclinks: numpy array[bool]
+            True for tokens that are Twitter picture links
+        hashtag_tokens: numpy array[bool]
+            True for tokens that are hashtags
+        urls, stop_words, alpha_only, hashtags: bool
+            Same flags as twitter_tokenizer
+    Returns:
+        numpy array[bool]
+            True for tokens to keep
+    """
+    keep = np.zeros(flags.shape[0], dtype=np.bool_)
+    for i in range(flags.shape[0]):
+        # remove URLs
+        if flags[i, 0] != 0 or (piclinks[i] and urls):
+            continue
+        # only include stop words if stop words==True
+        if flags[i, 1] != 0 and stop_words:
+            continue
+        # if alpha_only=True, only include alpha characters unless they are hashtags
+        if not (flags[i, 2] != 0 and alpha_only):
+            # only include hashtags if hashtags=False
+            if hashtags or not hashtag_tokens[i]:
+                continue
+        keep[i] = True
+    return keep
+
+
+def _apply_idf(counts, idf):
+    """
+    TF-IDF of a count matrix with the idf weights of a fitted TfidfVectorizer, same as its transform()
+    with the default settings
+
+    Parameters:
+        counts: scipy sparse matrix
+            Output of TopicSeries.count_matrix()
+        idf: numpy array
+            idf_ attribute of the TfidfVectorizer
+    Returns:
+        scipy sparse matrix
+            L2 normalized TF-IDF matrix
+    """
+    return normalize(counts @ sp.diags(idf.astype(counts.dtype)), copy=False)
+
+
+def _float32_components(model):
+    """
+    Shallow copy of a fitted Sklearn topic model with components_ (and exp_dirichlet_component_ for
+    LatentDirichletAllocation) downcast to float32, halving its size on disk
+    """
+    model = copy.copy(model)
+    model.components_ = model.components_.astype(np.float32)
+    if hasattr(model, 'exp_dirichlet_component_'):
+        model.exp_dirichlet_component_ = model.exp_dirichlet_component_.astype(np.float32)
+    return model
+
+
+def reconstruction_error(X, W, H):
+    """
+    Frobenius norm of X - WH, same as the reconstruction_err_ attribute of Sklearn's NMF.
+    Uses ||X - WH||^2 = ||X||^2 - 2<X, WH> + ||WH||^2 as Sklearn does for sparse X, so the dense
+    matrix WH is never built
+
+    Parameters:
+        X: scipy sparse matrix
+            Data matrix of shape (n_samples, n_features)
+        W: numpy array
+            Transformed data of shape (n_samples, n_components)
+        H: numpy array
+            NMF components of shape (n_components, n_features)
+    Returns:
+        float
+            Reconstruction error
+    """
+    X = X.tocsr()
+    # The three terms are large and nearly cancel, accumulate them in float64 even for float32 inputs
+    W = W.astype(np.float64)
+    H = H.astype(np.float64)
+    data = X.data.astype(np.float64)
+    norm_X = np.dot(data, data)
+    # <X, WH> = sum(XH' * W), XH' is only of shape (n_samples, n_components)
+    cross_prod = np.sum((X @ H.T) * W)
+    # ||WH||^2 = trace(W'W HH')
+    norm_WH = np.sum((W.T @ W) * (H @ H.T))
+    return np.sqrt(max(norm_X - 2 * cross_prod + norm_WH, 0))
+
+
 def display_components(model, word_features, top_display=5):
     """
     Displays the top words by probability in each topic of a topic model
@@ -220,8 +601,12 @@ def display_components(model, word_features, top_display=5):
         top_display: int, optional
             Number of words per topic displayed
     """
+    word_features = np.asarray(word_features, dtype=object)
+    # Clip to [0, number of words], [len(topic) - 0:] is empty unlike [-0:]
+    top_display = max(min(top_display, len(word_features)), 0)
     for topic_idx, topic in enumerate(model.components_):
         print("Topic {}:".format(topic_idx))
-        top_words_idx = topic.argsort()[::-1][:top_display]
-        top_words = [word_features[i] for i in top_words_idx]
-        print(" ".join(top_words))
+        # Partition to get the top words, then sort only those
+        top_words_idx = np.argpartition(topic, -top_display)[len(topic) - top_display:]
+        top_words_idx = top_words_idx[np.argsort(-topic[top_words_idx])]
+        print(" ".join(word_features[top_words_idx]))